@@ -1,18 +1,44 @@
+import argparse
+import hashlib
+import os
 import re
 import shutil
 import subprocess
 import sys
+import tarfile
+import threading
+import time
 import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+try:
+    import zstandard as zstd
+except ImportError:  # optional: only needed for --zst
+    zstd = None
+
 REPO_ROOT = Path(__file__).resolve().parents[1]
 MAIN_PY = REPO_ROOT / "unity_input_patcher.py"
+SPEC_FILE = REPO_ROOT / "unity_input_patcher.spec"
 VENV_DIR = REPO_ROOT / ".venv_build"
 DIST_DIR = REPO_ROOT / "dist"
 BUILD_DIR = REPO_ROOT / "build"
 PATCHES_DIR = REPO_ROOT / "patches"
+VENV_STAMP = VENV_DIR / ".stamp"
 
 UNITYPY_VERSION = "1.24.2"
+PYINSTALLER_VERSION = "6.22.3"
+BUILD_DEPS = [f"UnityPy=={UNITYPY_VERSION}", f"pyinstaller=={PYINSTALLER_VERSION}"]
+
+# Already-compressed payloads: deflate can't shrink them, so store as-is.
+# (Native .pyd/.dll binaries do deflate well, ~40%, so they are compressed.)
+ZIP_STORED_SUFFIXES = (".pyz", ".zip", ".whl", ".gz", ".bz2", ".xz", ".png", ".jpg", ".jpeg")
+ZIP_READ_CHUNK = 1 << 20
+
+# Per-worker read buffer for zip_dir.
+_zip_tls = threading.local()
 
 
 def run(cmd: list[str], *, cwd: Path | None = None) -> None:
@@ -28,100 +54,271 @@ def read_version() -> str:
     return m.group(1)
 
 
-def rm_tree(path: Path) -> None:
+def stamp_matches(stamp_path: Path, stamp: str) -> bool:
+    return stamp_path.exists() and stamp_path.read_text(encoding="utf-8").strip() == stamp
+
+
+# Fingerprint of everything the build venv is created from.
+def venv_stamp(python_version: str) -> str:
+    key = "\n".join([python_version, *BUILD_DEPS])
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+
+# sys.version as reported by the venv's own interpreter.
+def venv_python_version(py: Path) -> str:
+    return subprocess.check_output([str(py), "-c", "import sys; print(sys.version)"], text=True).strip()
+
+
+# The venv is current if it runs the same Python as this script and its deps are unchanged.
+def venv_is_current(py: Path) -> bool:
+    if not py.exists() or not VENV_STAMP.exists():
+        return False
+    try:
+        version = venv_python_version(py)
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    return version == sys.version and stamp_matches(VENV_STAMP, venv_stamp(version))
+
+
+# Fingerprint of everything the PyInstaller output is built from.
+def source_stamp() -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for p in (MAIN_PY, SPEC_FILE, VENV_STAMP):
+        h.update(p.read_bytes())
+    return h.hexdigest()
+
+
+# Delete a tree with the OS tool (much faster than shutil.rmtree on PyInstaller's
+# many-small-files output); shutil.rmtree mops up leftovers and surfaces real errors.
+def _fast_rmtree(path: Path) -> None:
+    try:
+        if os.name == "nt":
+            # String form so the quoted path reaches cmd intact (& etc. stay literal).
+            subprocess.call(f'cmd /c rmdir /s /q "{path}"', stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            subprocess.call(["rm", "-rf", "--", str(path)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except OSError:
+        pass
     if path.exists():
         shutil.rmtree(path)
 
 
+def rm_tree(path: Path) -> None:
+    if path.exists():
+        _fast_rmtree(path)
+
+
 def rm_file(path: Path) -> None:
     if path.exists():
         path.unlink()
 
 
-def zip_dir(src_dir: Path, zip_path: Path) -> None:
+# Collect (path, arcname, stat) for every file under a directory (one stat per entry).
+# Arcnames are built by prefix concatenation during the walk: no per-file Path/relative_to.
+def _scan_files(src_dir: str, prefix: str = "") -> list[tuple[str, str, os.stat_result]]:
+    out: list[tuple[str, str, os.stat_result]] = []
+    with os.scandir(src_dir) as it:
+        for e in it:
+            if e.is_dir(follow_symlinks=False):
+                out.extend(_scan_files(e.path, prefix + e.name + "/"))
+            elif e.is_file():
+                out.append((e.path, prefix + e.name, e.stat()))
+    return out
+
+
+# Read + compress one file (runs on a worker thread; zlib releases the GIL).
+def _compress_file(path: str, level: int | None) -> tuple[bytes, int, int]:
+    buf = getattr(_zip_tls, "buf", None)
+    if buf is None:
+        buf = _zip_tls.buf = bytearray(ZIP_READ_CHUNK)
+    view = memoryview(buf)
+
+    c = zlib.compressobj(level, zlib.DEFLATED, -15) if level is not None else None
+    parts: list[bytes] = []
+    crc = 0
+    size = 0
+    with open(path, "rb", buffering=0) as f:
+        while n := f.readinto(buf):
+            chunk = view[:n]
+            crc = zlib.crc32(chunk, crc)
+            size += n
+            parts.append(c.compress(chunk) if c else bytes(chunk))
+    if c:
+        parts.append(c.flush())
+    return b"".join(parts), crc, size
+
+
+# Append an entry whose payload/CRC/sizes are already final (mirrors ZipFile.open("w") bookkeeping).
+# NOTE: relies on private ZipFile internals (_writecheck, _didModify, start_dir), as used by
+# CPython 3.10-3.13's _open_to_write / _ZipWriteFile.close; re-check when bumping Python.
+def _write_precompressed(z: zipfile.ZipFile, zinfo: zipfile.ZipInfo, payload: bytes) -> None:
+    if not all(hasattr(z, a) for a in ("_writecheck", "_didModify", "start_dir")):
+        raise RuntimeError("zipfile internals changed; cannot write pre-compressed entries")
+    z.fp.seek(z.start_dir)
+    zinfo.header_offset = z.fp.tell()
+    z._writecheck(zinfo)
+    z._didModify = True
+    z.fp.write(zinfo.FileHeader())
+    z.fp.write(payload)
+    z.start_dir = z.fp.tell()
+    z.filelist.append(zinfo)
+    z.NameToInfo[zinfo.filename] = zinfo
+
+
+def zip_dir(src_dir: Path, zip_path: Path, *, compresslevel: int = 9) -> None:
     rm_file(zip_path)
     zip_path.parent.mkdir(parents=True, exist_ok=True)
 
-    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as z:
-        for p in src_dir.rglob("*"):
-            if p.is_file():
-                z.write(p, p.relative_to(src_dir))
+    workers = os.cpu_count() or 1
+    window = 2 * workers
+
+    with zipfile.ZipFile(zip_path, "w") as z, ThreadPoolExecutor(max_workers=workers) as pool:
+        # Write one finished entry (in walk order).
+        def write_next(pending: deque) -> None:
+            name, st, level, fut = pending.popleft()
+            payload, crc, size = fut.result()
+            zinfo = zipfile.ZipInfo(name, time.localtime(st.st_mtime)[0:6])
+            zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+            zinfo.compress_type = zipfile.ZIP_STORED if level is None else zipfile.ZIP_DEFLATED
+            zinfo.CRC = crc
+            zinfo.file_size = size
+            zinfo.compress_size = len(payload)
+            _write_precompressed(z, zinfo, payload)
+
+        # Entries are compressed in parallel, with at most `window` payloads held in memory.
+        pending: deque = deque()
+        for path, name, st in _scan_files(str(src_dir)):
+            level = None if name.lower().endswith(ZIP_STORED_SUFFIXES) else compresslevel
+            pending.append((name, st, level, pool.submit(_compress_file, path, level)))
+            if len(pending) >= window:
+                write_next(pending)
+        while pending:
+            write_next(pending)
+
+
+def tar_zst_dir(src_dir: Path, tar_path: Path, *, level: int = 15) -> None:
+    rm_file(tar_path)
+    tar_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # threads=-1 => one zstd worker per logical CPU.
+    cctx = zstd.ZstdCompressor(level=level, threads=-1)
+    with tar_path.open("wb") as f, cctx.stream_writer(f) as w, tarfile.open(fileobj=w, mode="w|") as t:
+        for p in sorted(src_dir.iterdir()):
+            t.add(p, arcname=p.name)
 
 
 def main(argv: list[str]) -> int:
+    ap = argparse.ArgumentParser(prog="build_windows")
+    ap.add_argument("--clean", action="store_true", help="remove PyInstaller's build/ work dir and dist/<name>/ after zipping")
+    ap.add_argument("--zip-level", type=int, choices=range(10), default=9, metavar="0-9",
+                    help="deflate level for the release ZIP (default: 9)")
+    ap.add_argument("--fast", action="store_true", help="fast ZIP for CI/iteration (same as --zip-level 1)")
+    ap.add_argument("--zst", action="store_true", help="also write a .tar.zst archive (requires zstandard)")
+    ap.add_argument("--force-clean", action="store_true",
+                    help="recreate the build venv and run PyInstaller with --clean")
+    args = ap.parse_args(argv)
+
     keep_build = True
     cleanup_after = False
+    zip_level = 1 if args.fast else args.zip_level
 
-    # Optional flag:
-    #   --clean  => remove build/<name>/ and dist/<name>/ after zipping
-    if "--clean" in argv:
+    if args.zst and zstd is None:
+        print("[build] ERROR: --zst requires the zstandard package (py -m pip install zstandard)")
+        return 1
+
+    if args.clean:
         cleanup_after = True
         keep_build = False
 
-    if not MAIN_PY.exists():
-        print(f"[build] ERROR: Missing {MAIN_PY}")
-        return 1
+    for required in (MAIN_PY, SPEC_FILE):
+        if not required.exists():
+            print(f"[build] ERROR: Missing {required}")
+            return 1
 
     ver = read_version()
     exename = f"unity-input-patcher-v{ver}"
     raw_dist_dir = DIST_DIR / exename
     outdir = DIST_DIR / f"unity-input-patcher-win64-v{ver}"
     zip_path = DIST_DIR / f"unity-input-patcher-win64-v{ver}.zip"
-    build_subdir = BUILD_DIR / exename
+    zst_path = DIST_DIR / f"unity-input-patcher-win64-v{ver}.tar.zst"
+    # PyInstaller's workpath for a spec build is build/<spec stem>/
+    build_subdir = BUILD_DIR / SPEC_FILE.stem
+    raw_exe = raw_dist_dir / f"{exename}.exe"
+    # Lives in PyInstaller's own work dir, so it is removed together with the build state
+    src_stamp_path = build_subdir / ".src.stamp"
 
     print(f"[build] Version: {ver}")
     print(f"[build] Output : {outdir}")
-    print(f"[build] ZIP    : {zip_path}")
+    print(f"[build] ZIP    : {zip_path} (level {zip_level})")
+    if args.zst:
+        print(f"[build] ZST    : {zst_path}")
     if cleanup_after:
         print("[build] Cleanup: enabled (--clean)")
 
     # Ensure dist exists, but don't wipe it globally
     DIST_DIR.mkdir(parents=True, exist_ok=True)
 
-    # Clean only version-specific outputs (safe re-runs)
-    rm_tree(raw_dist_dir)
+    # Clean only version-specific outputs (safe re-runs).
+    # dist/<name>/ is left alone: it is PyInstaller's output and may be reused below.
     rm_tree(outdir)
     rm_file(zip_path)
+    rm_file(zst_path)
 
-    # Clean/recreate build venv (deterministic builds)
-    rm_tree(VENV_DIR)
+    py = VENV_DIR / "Scripts" / "python.exe"
 
-    # Create clean build venv
-    run(["py", "-m", "venv", str(VENV_DIR)])
+    # Reuse the build venv unless its inputs changed (or --force-clean)
+    if not args.force_clean and venv_is_current(py):
+        print(f"[build] Reusing build venv: {VENV_DIR}")
+    else:
+        rm_tree(VENV_DIR)
 
-    py = VENV_DIR / "Scripts" / "python.exe"
-    if not py.exists():
-        print(f"[build] ERROR: venv python not found at {py}")
-        return 1
+        # Prefer uv (parallel downloads/installs) when it's on PATH
+        uv = shutil.which("uv")
 
-    # Install build deps (kept separate from runtime requirements.txt)
-    run([str(py), "-m", "pip", "install", "--upgrade", "pip"])
-    run([str(py), "-m", "pip", "install", f"UnityPy=={UNITYPY_VERSION}", "pyinstaller"])
-
-    # Build (patches remain external: no --add-data)
-    run([
-        str(py), "-m", "PyInstaller",
-        "--noconfirm",
-        "--clean",
-        "--onedir",
-        "--noupx",
-        "--collect-all", "UnityPy",
-        "--name", exename,
-        str(MAIN_PY),
-    ], cwd=REPO_ROOT)
+        # Create clean build venv (same interpreter on both paths: the one running this script)
+        if uv:
+            run([uv, "venv", "--python", sys.executable, str(VENV_DIR)])
+        else:
+            run([sys.executable, "-m", "venv", str(VENV_DIR)])
+
+        if not py.exists():
+            print(f"[build] ERROR: venv python not found at {py}")
+            return 1
+
+        # Install build deps (kept separate from runtime requirements.txt).
+        # One pip run: a single resolve, and pip upgrades itself alongside.
+        if uv:
+            run([uv, "pip", "install", "--python", str(py), *BUILD_DEPS])
+        else:
+            run([str(py), "-m", "pip", "install", "--upgrade", "pip", *BUILD_DEPS])
+
+        VENV_STAMP.write_text(venv_stamp(venv_python_version(py)) + "\n", encoding="utf-8")
+
+    # Skip PyInstaller entirely if nothing it builds from has changed
+    src_stamp = source_stamp()
+    if not args.force_clean and raw_exe.exists() and stamp_matches(src_stamp_path, src_stamp):
+        print(f"[build] Sources unchanged, reusing: {raw_dist_dir}")
+    else:
+        rm_file(src_stamp_path)
+
+        # Build from the checked-in spec (onedir, no UPX, patches remain external).
+        # build/<spec stem>/ is kept between runs so PyInstaller can reuse its analysis.
+        run([
+            str(py), "-m", "PyInstaller",
+            "--noconfirm",
+            *(["--clean"] if args.force_clean else []),
+            str(SPEC_FILE),
+        ], cwd=REPO_ROOT)
+
+        if raw_exe.exists() and build_subdir.is_dir():
+            src_stamp_path.write_text(src_stamp + "\n", encoding="utf-8")
 
     if not raw_dist_dir.exists():
         print(f"[build] ERROR: Expected build output folder missing: {raw_dist_dir}")
         return 1
 
     # Create release folder (exe + _internal at root)
-    outdir.mkdir(parents=True, exist_ok=True)
-    for item in raw_dist_dir.iterdir():
-        dest = outdir / item.name
-        if item.is_dir():
-            shutil.copytree(item, dest, dirs_exist_ok=True)
-        else:
-            shutil.copy2(item, dest)
+    shutil.copytree(raw_dist_dir, outdir, dirs_exist_ok=True)
 
     # Copy patches next to exe as normal files (external, not embedded)
     if PATCHES_DIR.exists():
@@ -130,7 +327,9 @@ def main(argv: list[str]) -> int:
     (outdir / "VERSION.txt").write_text(ver + "\n", encoding="utf-8")
 
     # Zip the release folder contents (root = exe/_internal/patches/...)
-    zip_dir(outdir, zip_path)
+    zip_dir(outdir, zip_path, compresslevel=zip_level)
+    if args.zst:
+        tar_zst_dir(outdir, zst_path)
 
     # Optional cleanup after zipping
     if cleanup_after:
@@ -140,6 +339,8 @@ def main(argv: list[str]) -> int:
 
     print(f"[build] OK: {outdir}")
     print(f"[build] OK: {zip_path}")
+    if args.zst:
+        print(f"[build] OK: {zst_path}")
     return 0
 
 
@@ -2,22 +2,82 @@
 from __future__ import annotations
 
 import argparse
+import collections
+import copy
+import functools
 import json
-import math
+import operator
+import os
+import shutil
 import sys
 from pathlib import Path
-from typing import Any, Optional, Tuple
+from typing import Any, Callable, NamedTuple, Optional, Tuple
 
-import UnityPy
+try:
+    import orjson
+except ImportError:  # optional: faster JSON parsing when installed
+    orjson = None
 
 VERSION = "0.1.2"
 PATCH_DEFAULT = "patch.json"
 FLOAT_EPS = 1e-6
+NUMBER_TYPES = (int, float)  # exact types: bool is deliberately excluded
 
+ENV_CACHE_SIZE = 2
 
-# Read JSON from disk.
+# Loaded UnityPy environments, least recently used first: str(path) -> (mtime_ns, size, env).
+# Each cached env keeps its Unity file open; entries are closed when evicted or invalidated.
+_env_cache: collections.OrderedDict[str, Tuple[int, int, Any]] = collections.OrderedDict()
+
+
+# Parse a JSON file; cached per (path, mtime, size) so unchanged files aren't re-read.
+@functools.lru_cache(maxsize=32)
+def _load_json_cached(path: str, mtime_ns: int, size: int) -> dict:
+    if orjson is not None:
+        return orjson.loads(Path(path).read_bytes())
+    return json.loads(Path(path).read_text(encoding="utf-8"))
+
+
+# Read JSON from disk (returns a private copy callers may mutate).
 def load_json(p: Path) -> dict:
-    return json.loads(p.read_text(encoding="utf-8"))
+    st = p.stat()
+    return copy.deepcopy(_load_json_cached(str(p), st.st_mtime_ns, st.st_size))
+
+
+# Close the file handles UnityPy keeps open for an env (UnityPy-version tolerant).
+# The env must not be used afterwards.
+def close_env(env: Any) -> None:
+    for f in list(getattr(env, "files", {}).values()):
+        stream = getattr(getattr(f, "reader", f), "stream", None)
+        if stream is not None and hasattr(stream, "close"):
+            stream.close()
+
+
+# Load a Unity file, reusing the parsed env while the file is unchanged on disk.
+def load_env(p: Path) -> Any:
+    st = p.stat()
+    key = str(p)
+    hit = _env_cache.get(key)
+    if hit is not None and hit[0] == st.st_mtime_ns and hit[1] == st.st_size:
+        _env_cache.move_to_end(key)
+        return hit[2]
+    invalidate_env(p)
+
+    # Imported lazily: UnityPy is heavy, and --help / usage / validation errors don't need it.
+    import UnityPy
+
+    env = UnityPy.load(key)
+    _env_cache[key] = (st.st_mtime_ns, st.st_size, env)
+    while len(_env_cache) > ENV_CACHE_SIZE:
+        close_env(_env_cache.popitem(last=False)[1][2])
+    return env
+
+
+# Drop a cached env and close its file handles.
+def invalidate_env(p: Path) -> None:
+    hit = _env_cache.pop(str(p), None)
+    if hit is not None:
+        close_env(hit[2])
 
 
 # Resolve game root (arg or CWD).
@@ -115,57 +175,111 @@ def write_tree(o: Any, d: dict) -> None:
 
 
 # Compare values with float tolerance; strict for everything else.
-def equal(a: Any, b: Any) -> bool:
-    if isinstance(a, (int, float)) and not isinstance(a, bool) and isinstance(b, (int, float)) and not isinstance(b, bool):
-        return math.isfinite(float(a)) and math.isfinite(float(b)) and abs(float(a) - float(b)) <= FLOAT_EPS
+# Non-finite numbers never match (inf - inf and anything involving nan give nan).
+def equal(a: Any, b: Any, eps: float = FLOAT_EPS, num: tuple = NUMBER_TYPES) -> bool:
+    if type(a) in num and type(b) in num:
+        return abs(a - b) <= eps
     return a == b
 
 
+# Pick the comparator for a toggle once: tolerant only if the patch values are numeric.
+def comparator(original: Any, patched: Any) -> Callable[[Any, Any], bool]:
+    if type(original) in NUMBER_TYPES or type(patched) in NUMBER_TYPES:
+        return equal
+    return operator.eq
+
+
 # Decide whether to apply or revert based on current value.
-def toggle_decision(current: Any, original: Any, patched: Any) -> Tuple[Optional[Any], str]:
-    if equal(current, original):
+def toggle_decision(
+    current: Any, original: Any, patched: Any, eq: Callable[[Any, Any], bool] = equal
+) -> Tuple[Optional[Any], str]:
+    if eq(current, original):
         return patched, "applied"
-    if equal(current, patched):
+    if eq(current, patched):
         return original, "reverted"
     return None, "unknown"
 
 
-# Apply a single legacy InputManager axis field toggle.
-def toggle_legacy_axis_field(
-    axes: list[dict],
-    axis_index: int,
-    field: str,
-    original: Any,
-    patched: Any,
-    axis_name: Optional[str],
-) -> Tuple[str, str, str]:
+# A validated toggle entry.
+class Toggle(NamedTuple):
+    axis_index: int
+    field: str
+    original: Any
+    patched: Any
+    axis_name: Optional[str]
+
+
+# Validate toggle entries once, up front.
+def parse_toggles(toggles: list) -> list[Toggle]:
+    out: list[Toggle] = []
+    for t in toggles:
+        if not isinstance(t, dict):
+            raise RuntimeError(f"Bad toggle entry (not object): {t!r}")
+        if t.get("type") != "legacy_axis_field":
+            raise RuntimeError(f"Unsupported toggle type: {t.get('type')!r}")
+
+        # Read required toggle fields.
+        try:
+            axis_index = int(req(t, "axis"))
+        except Exception:
+            raise RuntimeError(f"Toggle entry has non-integer 'axis': {t.get('axis')!r}")
+        field = str(req(t, "field"))
+        original = req(t, "original")
+        patched = req(t, "patched")
+        axis_name = t.get("axis_name")
+        axis_name = str(axis_name) if isinstance(axis_name, str) and axis_name.strip() else None
+
+        out.append(Toggle(axis_index, field, original, patched, axis_name))
+    return out
+
+
+# Look up a legacy InputManager axis by index, checking its name when given.
+def resolve_axis(axes: list[dict], axis_index: int, axis_name: Optional[str]) -> dict:
     if axis_index < 0 or axis_index >= len(axes):
         raise IndexError(f"Axis index out of range: {axis_index} (axes={len(axes)})")
 
     ax = axes[axis_index]
-    name = ax.get("m_Name", "")
-
     if axis_name:
+        name = ax.get("m_Name", "")
         if name != axis_name:
             raise RuntimeError(f"Axis name mismatch at index {axis_index}: expected {axis_name!r}, found {name!r}")
+    return ax
+
+
+# Apply a single legacy InputManager axis field toggle (axis already resolved).
+# Returns (mode, log line, check, whether the value actually changed).
+def toggle_legacy_axis_field(
+    ax: dict,
+    axis_index: int,
+    field: str,
+    original: Any,
+    patched: Any,
+    axis_name: Optional[str],
+) -> Tuple[str, str, str, bool]:
+    name = ax.get("m_Name", "")
 
     if field not in ax:
         raise RuntimeError(f"Field {field!r} not present on axis[{axis_index}] (name={name!r})")
 
     cur = ax[field]
-    new, mode = toggle_decision(cur, original, patched)
+    eq = comparator(original, patched)
+    new, mode = toggle_decision(cur, original, patched, eq)
     if new is None:
         raise RuntimeError(
             f"Unknown state for axis[{axis_index}] {name!r}.{field}: current={cur!r}, expected {original!r} or {patched!r}"
         )
 
-    ax[field] = new
+    changed = not eq(new, cur)
+    if changed:
+        ax[field] = new
     line = f"axis[{axis_index}] {name!r}.{field}: {cur!r} -> {new!r}"
     check = f"axis_name_ok ({name!r})" if axis_name else "axis_name_skipped"
-    return mode, line, check
+    return mode, line, check, changed
 
 
 # Serialize the modified Unity file back to the original path (in-place).
+# Writes via a temp file + os.replace. UnityPy holds the source file open without
+# FILE_SHARE_DELETE, so the env is closed (and unusable) before the replace.
 def save_in_place(env: Any, out_path: Path) -> None:
     data = None
     if hasattr(env, "file") and hasattr(env.file, "save"):
@@ -174,7 +288,21 @@ def save_in_place(env: Any, out_path: Path) -> None:
         data = env.fs.save()
     if data is None:
         raise RuntimeError("UnityPy could not serialize (no save() available)")
-    out_path.write_bytes(data)
+
+    close_env(env)
+
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    try:
+        tmp.write_bytes(data)
+        if out_path.exists():
+            shutil.copymode(out_path, tmp)
+        os.replace(tmp, out_path)
+    except PermissionError as e:
+        tmp.unlink(missing_ok=True)
+        raise PermissionError(e.errno, e.strerror, str(out_path)) from e
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
 
 
 # Run one toggle pass.
@@ -206,6 +334,7 @@ def run(game_root: Path, patch_path: Path) -> None:
     toggles = patch.get("toggle")
     if not isinstance(toggles, list) or not toggles:
         raise RuntimeError("patch.json missing required non-empty list: 'toggle'")
+    entries = parse_toggles(toggles)
 
     print(f"[UnityInputPatcher] Loaded patch: {patch_name} ({patch_id})")
     print(f"[UnityInputPatcher] Root: {q(game_root)}")
@@ -215,7 +344,7 @@ def run(game_root: Path, patch_path: Path) -> None:
         label = "item" if count == 1 else "items"
         print(f"[UnityInputPatcher] Root check: OK ({count} required {label})")
 
-    env = UnityPy.load(str(file_path))
+    env = load_env(file_path)
     im = find_obj(env, "InputManager")
     d = read_tree(im)
 
@@ -223,35 +352,18 @@ def run(game_root: Path, patch_path: Path) -> None:
     if not isinstance(axes, list):
         raise RuntimeError("InputManager.m_Axes missing or unexpected format")
 
+    targets = [(resolve_axis(axes, t.axis_index, t.axis_name), t) for t in entries]
+
     mode_seen: Optional[str] = None
     checks: list[str] = []
     logs: list[str] = []
+    dirty = False
 
-    for t in toggles:
-        if not isinstance(t, dict):
-            raise RuntimeError(f"Bad toggle entry (not object): {t!r}")
-        if t.get("type") != "legacy_axis_field":
-            raise RuntimeError(f"Unsupported toggle type: {t.get('type')!r}")
-
-        # Read required toggle fields.
-        try:
-            axis_index = int(req(t, "axis"))
-        except Exception:
-            raise RuntimeError(f"Toggle entry has non-integer 'axis': {t.get('axis')!r}")
-        field = str(req(t, "field"))
-        original = req(t, "original")
-        patched = req(t, "patched")
-        axis_name = t.get("axis_name")
-        axis_name = str(axis_name) if isinstance(axis_name, str) and axis_name.strip() else None
-
-        mode, line, check = toggle_legacy_axis_field(
-            axes=axes,
-            axis_index=axis_index,
-            field=field,
-            original=original,
-            patched=patched,
-            axis_name=axis_name,
+    for ax, t in targets:
+        mode, line, check, changed = toggle_legacy_axis_field(
+            ax, t.axis_index, t.field, t.original, t.patched, t.axis_name
         )
+        dirty = dirty or changed
 
         if mode_seen is None:
             mode_seen = mode
@@ -261,14 +373,21 @@ def run(game_root: Path, patch_path: Path) -> None:
         checks.append(check)
         logs.append(line)
 
-    d["m_Axes"] = axes
-    write_tree(im, d)
-    save_in_place(env, file_path)
+    # Nothing to serialize if every toggle was a no-op.
+    # The env is modified (and closed by save_in_place) either way, so it leaves the cache.
+    if dirty:
+        try:
+            write_tree(im, d)
+            save_in_place(env, file_path)
+        finally:
+            invalidate_env(file_path)
 
     for c in checks:
         print(f"[UnityInputPatcher] Check: {c}")
     for l in logs:
         print(f"[UnityInputPatcher] Patched: {l}")
+    if not dirty:
+        print("[UnityInputPatcher] No-op: file already in target state (not rewritten).")
 
     if mode_seen == "applied":
         print("[UnityInputPatcher] Patch applied OK.")
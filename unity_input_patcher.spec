@@ -0,0 +1,57 @@
+# -*- mode: python ; coding: utf-8 -*-
+# PyInstaller spec for the Windows release (used by tools/build_windows.py).
+# One-dir build, no UPX; patches stay external (no datas besides UnityPy's).
+import re
+from pathlib import Path
+
+from PyInstaller.utils.hooks import collect_all
+
+main_py = Path(SPECPATH) / "unity_input_patcher.py"
+m = re.search(r'^\s*VERSION\s*=\s*"([^"]+)"\s*$', main_py.read_text(encoding="utf-8"), re.M)
+if not m:
+    raise SystemExit('[spec] ERROR: Could not find VERSION = "..." in unity_input_patcher.py')
+name = f"unity-input-patcher-v{m.group(1)}"
+
+# UnityPy loads its typetree/class data at runtime; collect everything.
+datas, binaries, hiddenimports = collect_all("UnityPy")
+
+a = Analysis(
+    [str(main_py)],
+    pathex=[],
+    binaries=binaries,
+    datas=datas,
+    hiddenimports=hiddenimports,
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=[],
+    noarchive=False,
+)
+pyz = PYZ(a.pure)
+
+exe = EXE(
+    pyz,
+    a.scripts,
+    [],
+    exclude_binaries=True,
+    name=name,
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=False,
+    console=True,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+)
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=False,
+    upx_exclude=[],
+    name=name,
+)